@@ -143,6 +143,78 @@ TEMPLATES[0]['DIRS'] = [BASE_DIR/ 'templates']
 
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 
+# Celery task topology: one queue per workload so a long report can't starve
+# fraud scoring. Run a worker per queue and size concurrency per workload, e.g.
+#   celery -A analytics_dashboard worker -Q ingestion -c 8 --prefetch-multiplier 4
+#   celery -A analytics_dashboard worker -Q fraud -c 4
+#   celery -A analytics_dashboard worker -Q notifications -c 4 --prefetch-multiplier 4
+#   celery -A analytics_dashboard worker -Q reporting -c 1
+#   celery -A analytics_dashboard beat
+from celery.schedules import crontab
+from kombu import Queue
+
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_QUEUES = (
+    Queue('default'),
+    Queue('ingestion'),
+    Queue('fraud'),
+    Queue('notifications'),
+    Queue('reporting'),
+)
+CELERY_TASK_ROUTES = {
+    'core.tasks.ingest_*': {'queue': 'ingestion'},
+    'core.tasks.relay_outbox': {'queue': 'ingestion'},
+    'core.tasks.detect_fraud': {'queue': 'fraud'},
+    'core.tasks.check_fraud': {'queue': 'fraud'},
+    'core.tasks.send_sms': {'queue': 'notifications'},
+    'core.tasks.report_*': {'queue': 'reporting'},
+}
+# Each run expires after one interval, so runs queued during a worker outage
+# are dropped instead of all executing on recovery
+CELERY_BEAT_SCHEDULE = {
+    'fraud-scan': {
+        'task': 'core.tasks.detect_fraud',
+        'schedule': crontab(minute='*/5'),
+        'options': {'expires': 5 * 60},
+    },
+    'stripe-reconcile': {
+        'task': 'core.tasks.report_reconcile_stripe',
+        'schedule': crontab(hour=3, minute=0),
+        'options': {'expires': 24 * 60 * 60},
+    },
+    'outbox-relay': {
+        'task': 'core.tasks.relay_outbox',
+        'schedule': 5.0,
+        'options': {'expires': 5},
+    },
+}
+
+# Default for long tasks: hold one message at a time and ack only once finished;
+# short-task queues raise the multiplier on their own worker (see above)
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_SOFT_TIME_LIMIT = 5 * 60
+CELERY_TASK_TIME_LIMIT = 6 * 60
+
+# Recent-activity ring buffers (core/recent_activity.py)
+RECENT_ACTIVITY_REDIS_URL = os.getenv('RECENT_ACTIVITY_REDIS_URL', 'redis://localhost:6379/1')
+RECENT_ACTIVITY_SIZE = 5000
+DASHBOARD_RECENT_LIMIT = 500
+
+# Transactional outbox relay (core/outbox.py); 'log' prints events instead of sending
+KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
+OUTBOX_PUBLISHER = os.getenv('OUTBOX_PUBLISHER', 'kafka')
+OUTBOX_TOPIC = 'ledger-events'
+OUTBOX_BATCH_SIZE = 500
+# Batches per relay run, keeping each run well inside its time limit
+OUTBOX_RELAY_MAX_BATCHES = 20
+
+# Stripe reconciliation (core/reconciliation.py): the window is paged from
+# Stripe in RECONCILE_SLICE chunks, RECONCILE_WORKERS at a time
+from datetime import timedelta
+RECONCILE_WORKERS = 8
+RECONCILE_SLICE = timedelta(hours=6)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,12 +1,16 @@
 # core/kafka_consumer.py
-from kafka import KafkaConsumer
-import json
-from .models import Transaction
 import django
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "analytics_dashboard.settings")
 django.setup()
 
+from kafka import KafkaConsumer
+import json
+from decimal import Decimal
+from django.db.transaction import atomic
+from .models import Transaction
+from . import outbox, recent_activity
+
 consumer = KafkaConsumer(
     'transactions',
     bootstrap_servers='localhost:9092',
@@ -16,9 +20,12 @@ consumer = KafkaConsumer(
 
 for msg in consumer:
     data = json.loads(msg.value)
-    Transaction.objects.create(
-        amount=data['amount'],
-        merchant=data['merchant'],
-        user_id=data['user_id'],
-        description=data['description']
-    )
+    with atomic():
+        transaction = Transaction.objects.create(
+            # Decimal like the column, so cached rows and events match a DB read
+            amount=Decimal(str(data['amount'])).quantize(Decimal('0.01')),
+            transaction_type=data.get('transaction_type', 'debit'),
+            description=data.get('description', '')
+        )
+        outbox.record_transaction(transaction)
+    recent_activity.record_transaction(transaction)
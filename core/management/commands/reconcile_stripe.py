@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.reconciliation import reconcile
+
+
+class Command(BaseCommand):
+    help = "Reconcile settled Stripe charges with the local Transaction ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="Window start, YYYY-MM-DD (UTC)")
+        parser.add_argument('--end', help="Window end (exclusive), YYYY-MM-DD (UTC), defaults to today")
+        parser.add_argument('--days', type=int, default=1, help="Window length when --start is omitted")
+        parser.add_argument('--workers', type=int, help="Concurrent Stripe page fetches")
+        parser.add_argument('--dry-run', action='store_true', help="Report differences without repairing")
+        parser.add_argument('--no-resume', action='store_true', help="Ignore checkpoints from an earlier run")
+        parser.add_argument(
+            '--backfill-only',
+            action='store_true',
+            help="Only link rows written before PaymentIntents were recorded; run once over past windows",
+        )
+
+    def handle(self, *args, **options):
+        end = self._date(options['end']) if options['end'] else timezone.now().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        start = self._date(options['start']) if options['start'] else end - timedelta(days=options['days'])
+        if start >= end:
+            raise CommandError("--start must be before --end")
+
+        summary = reconcile(
+            start,
+            end,
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+            resume=not options['no_resume'],
+            backfill_only=options['backfill_only'],
+        )
+
+        self.stdout.write(f"Window: {start:%Y-%m-%d %H:%M} → {end:%Y-%m-%d %H:%M}")
+        self.stdout.write(f"Settled charges: {summary['settled']}")
+        self.stdout.write(f"Missing locally: {summary['missing']}")
+        self.stdout.write(f"Amount mismatches: {summary['mismatched']}")
+        self.stdout.write(f"Linked legacy rows: {summary['backfilled']}")
+        if summary['unresolved']:
+            self.stdout.write(self.style.WARNING(
+                f"Missing but not inserted (unlinked legacy rows in their slice): {summary['unresolved']}"
+            ))
+        if summary['resumed_slices']:
+            self.stdout.write(f"Resumed slices: {summary['resumed_slices']}")
+        if summary['orphans']:
+            self.stdout.write(self.style.WARNING(
+                f"Ledger rows with no settled charge: {', '.join(map(str, summary['orphans']))}"
+            ))
+        verb = "Found" if options['dry_run'] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {summary['missing'] + summary['mismatched']} differences"
+        ))
+
+    def _date(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+        except ValueError:
+            raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD")
@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # The unique index is built CONCURRENTLY so it doesn't block writes to the
+    # ledger, which can't happen inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0005_outboxevent'),
+    ]
+
+    operations = [
+        # Nullable with no default, so PostgreSQL adds it without a table rewrite
+        migrations.AddField(
+            model_name='transaction',
+            name='stripe_payment_intent',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql=(
+                        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "core_tx_stripe_pi_uniq" '
+                        'ON "core_transaction" ("stripe_payment_intent")'
+                    ),
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "core_tx_stripe_pi_uniq"',
+                ),
+                # Attaching a ready index as the constraint only takes a brief lock
+                migrations.RunSQL(
+                    sql=(
+                        'ALTER TABLE "core_transaction" ADD CONSTRAINT "core_tx_stripe_pi_uniq" '
+                        'UNIQUE USING INDEX "core_tx_stripe_pi_uniq"'
+                    ),
+                    reverse_sql='ALTER TABLE "core_transaction" DROP CONSTRAINT IF EXISTS "core_tx_stripe_pi_uniq"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='transaction',
+                    constraint=models.UniqueConstraint(fields=('stripe_payment_intent',), name='core_tx_stripe_pi_uniq'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-19 11:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, but doesn't
+    # block writes to the large ledger tables while it builds
+    atomic = False
+
+    dependencies = [
+        ('core', '0006_transaction_stripe_payment_intent'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['timestamp'], name='core_tx_timestamp_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', '-id'], name='core_tx_type_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('is_fraud', True)), fields=['-id'], name='core_tx_fraud_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='failedpayment',
+            index=models.Index(fields=['timestamp'], name='core_failed_timestamp_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='failedpayment',
+            index=models.Index(fields=['customer_id'], name='core_failed_customer_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='failedpayment',
+            index=models.Index(fields=['email'], name='core_failed_email_idx'),
+        ),
+    ]
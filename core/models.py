@@ -1,5 +1,6 @@
 # core/models.py
 
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 class Transaction(models.Model):
@@ -13,6 +14,19 @@ class Transaction(models.Model):
     description = models.TextField(blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     is_fraud = models.BooleanField(default=False)
+    # Stripe PaymentIntent (or Charge, for charges without one) this row records
+    stripe_payment_intent = models.CharField(max_length=255, blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stripe_payment_intent'], name='core_tx_stripe_pi_uniq'),
+        ]
+        # Back the admin's newest-first changelist and its type/fraud/date filters
+        indexes = [
+            models.Index(fields=['timestamp'], name='core_tx_timestamp_idx'),
+            models.Index(fields=['transaction_type', '-id'], name='core_tx_type_id_idx'),
+            models.Index(fields=['-id'], condition=models.Q(is_fraud=True), name='core_tx_fraud_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.transaction_type.capitalize()} - ${self.amount}"
@@ -27,7 +41,33 @@ class FailedPayment(models.Model):
     customer_id = models.CharField(max_length=100, blank=True, null=True)
     email = models.EmailField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='core_failed_timestamp_idx'),
+            models.Index(fields=['customer_id'], name='core_failed_customer_idx'),
+            models.Index(fields=['email'], name='core_failed_email_idx'),
+        ]
+
     def __str__(self):
         return f"Failed Payment - ${self.amount} - {self.timestamp}"
 
 
+
+
+class OutboxEvent(models.Model):
+    """
+    Ledger change waiting to be published downstream. Written in the same DB
+    transaction as the change itself and deleted once the relay has sent it.
+    """
+    aggregate_type = models.CharField(max_length=50)
+    aggregate_id = models.BigIntegerField()
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # The relay drains in id order, which keeps events per aggregate in order
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.event_type} - {self.aggregate_type}:{self.aggregate_id}"
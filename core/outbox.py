@@ -0,0 +1,182 @@
+# core/outbox.py
+import json
+
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+
+from .models import OutboxEvent, Transaction
+
+# Transactional outbox: ledger writers call record_* inside the same atomic()
+# block as their change, and relay() later publishes the rows in batches.
+# Delivery is at-least-once; consumers dedupe on the event id.
+
+TRANSACTION_FIELDS = ('id', 'amount', 'description', 'timestamp', 'transaction_type', 'is_fraud')
+FAILED_PAYMENT_FIELDS = ('id', 'amount', 'error_message', 'timestamp', 'customer_id', 'email')
+
+RELAY_LOCK = 'lock:outbox_relay'
+RELAY_LOCK_TIMEOUT = 60
+
+
+# ------------------ Writers ------------------
+def record(aggregate_type, aggregate_id, event_type, payload):
+    return OutboxEvent.objects.create(
+        aggregate_type=aggregate_type,
+        aggregate_id=aggregate_id,
+        event_type=event_type,
+        payload=payload,
+    )
+
+
+def record_transaction(transaction, event_type='transaction.created'):
+    payload = {field: getattr(transaction, field) for field in TRANSACTION_FIELDS}
+    return record('transaction', transaction.id, event_type, payload)
+
+
+def bulk_record_transactions(transactions, event_type):
+    return OutboxEvent.objects.bulk_create([
+        OutboxEvent(
+            aggregate_type='transaction',
+            aggregate_id=transaction.id,
+            event_type=event_type,
+            payload={field: getattr(transaction, field) for field in TRANSACTION_FIELDS},
+        )
+        for transaction in transactions
+    ])
+
+
+def set_transactions_fraud(queryset, is_fraud, event_type):
+    """
+    Flip is_fraud on every row of the queryset that differs and write their
+    outbox events, in one UPDATE ... RETURNING feeding an INSERT ... SELECT,
+    so the rows never come into Python. Returns the number of rows changed.
+    """
+    subquery, params = queryset.order_by().values('id').query.sql_with_params()
+    # Payload matches record_transaction: amount as a string and the timestamp
+    # as DjangoJSONEncoder writes it, UTC with "Z" and milliseconds if any
+    sql = f"""
+        WITH changed AS (
+            UPDATE "{Transaction._meta.db_table}" SET "is_fraud" = %s
+            WHERE "id" IN ({subquery}) AND "is_fraud" <> %s
+            RETURNING "id", "amount", "description", "timestamp", "transaction_type", "is_fraud"
+        )
+        INSERT INTO "{OutboxEvent._meta.db_table}"
+            ("aggregate_type", "aggregate_id", "event_type", "payload", "created_at")
+        SELECT 'transaction', "id", %s,
+            jsonb_build_object(
+                'id', "id",
+                'amount', "amount"::text,
+                'description', "description",
+                'timestamp',
+                    to_char("timestamp" AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS')
+                    || CASE WHEN extract(microseconds FROM "timestamp")::bigint %% 1000000 <> 0
+                        THEN to_char("timestamp" AT TIME ZONE 'UTC', '.MS') ELSE '' END
+                    || 'Z',
+                'transaction_type', "transaction_type",
+                'is_fraud', "is_fraud"
+            ),
+            now()
+        FROM changed
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [is_fraud, *params, is_fraud, event_type])
+        return cursor.rowcount
+
+
+def record_failed_payment(failed_payment, event_type='failed_payment.created'):
+    payload = {field: getattr(failed_payment, field) for field in FAILED_PAYMENT_FIELDS}
+    return record('failed_payment', failed_payment.id, event_type, payload)
+
+
+# ------------------ Publishers ------------------
+class LogPublisher:
+    """Local stand-in for Kafka, prints events instead of sending them."""
+
+    def publish(self, events):
+        for event in events:
+            print(f"📤 {event['event_type']} {event['key']} #{event['id']}")
+
+
+class KafkaPublisher:
+    def __init__(self):
+        from kafka import KafkaProducer
+
+        self.producer = KafkaProducer(
+            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+            key_serializer=str.encode,
+            value_serializer=lambda value: json.dumps(value, cls=DjangoJSONEncoder).encode(),
+            acks='all',
+            linger_ms=5,
+        )
+
+    def publish(self, events):
+        # Keying by aggregate keeps each aggregate's events on one partition, in order
+        futures = [
+            self.producer.send(settings.OUTBOX_TOPIC, key=event['key'], value=event)
+            for event in events
+        ]
+        self.producer.flush()
+        for future in futures:
+            future.get()
+
+
+PUBLISHERS = {
+    'log': LogPublisher,
+    'kafka': KafkaPublisher,
+}
+
+_publisher = None
+
+
+def get_publisher():
+    global _publisher
+    if _publisher is None:
+        _publisher = PUBLISHERS[settings.OUTBOX_PUBLISHER]()
+    return _publisher
+
+
+# ------------------ Relay ------------------
+def _event(row):
+    return {
+        'id': row.id,
+        'key': f"{row.aggregate_type}:{row.aggregate_id}",
+        'aggregate_type': row.aggregate_type,
+        'aggregate_id': row.aggregate_id,
+        'event_type': row.event_type,
+        'payload': row.payload,
+        'created_at': row.created_at,
+    }
+
+
+def relay(batch_size=None, max_batches=None):
+    """
+    Publish pending events oldest first and delete each batch once sent.
+    Returns the number of events published.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    # A single relay at a time, otherwise two could interleave an aggregate's events
+    lock = client.lock(RELAY_LOCK, timeout=RELAY_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+
+    published = 0
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            rows = list(OutboxEvent.objects.order_by('id')[:batch_size])
+            if not rows:
+                break
+
+            get_publisher().publish([_event(row) for row in rows])
+            # One set-based DELETE per batch. Not a range on id: a lower id can
+            # still be uncommitted when this batch was read.
+            OutboxEvent.objects.filter(id__in=[row.id for row in rows]).delete()
+
+            published += len(rows)
+            batches += 1
+            lock.extend(RELAY_LOCK_TIMEOUT, replace_ttl=True)
+    finally:
+        lock.release()
+    return published
@@ -0,0 +1,153 @@
+# core/recent_activity.py
+import json
+
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+from .models import Transaction, FailedPayment
+
+# Fixed-size, newest-first ring buffers of recent rows kept in Redis lists.
+# Writers LPUSH + LTRIM so each list never grows past RECENT_ACTIVITY_SIZE;
+# readers LRANGE the head and only fall back to PostgreSQL on a miss.
+
+TRANSACTIONS_KEY = 'recent:transactions'
+FAILED_PAYMENTS_KEY = 'recent:failed_payments'
+
+TRANSACTION_FIELDS = ('id', 'amount', 'description', 'timestamp', 'transaction_type', 'is_fraud')
+FAILED_PAYMENT_FIELDS = ('id', 'amount', 'error_message', 'timestamp', 'customer_id', 'email')
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.RECENT_ACTIVITY_REDIS_URL)
+    return _client
+
+
+def _row(obj, fields):
+    return {field: getattr(obj, field) for field in fields}
+
+
+def _dumps(row):
+    # Same encoder JsonResponse uses, so cached rows match the API shape
+    return json.dumps(row, cls=DjangoJSONEncoder)
+
+
+def _loads(raw):
+    row = json.loads(raw)
+    row['timestamp'] = parse_datetime(row['timestamp'])
+    return row
+
+
+# ------------------ Writers ------------------
+def _push(key, row):
+    try:
+        pipe = get_client().pipeline()
+        pipe.lpush(key, _dumps(row))
+        pipe.ltrim(key, 0, settings.RECENT_ACTIVITY_SIZE - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        # The DB row is the source of truth; a missed push only costs a fallback read
+        print("⚠️ Could not update recent activity buffer:", str(e))
+
+
+def record_transaction(transaction):
+    _push(TRANSACTIONS_KEY, _row(transaction, TRANSACTION_FIELDS))
+
+
+def record_failed_payment(failed_payment):
+    _push(FAILED_PAYMENTS_KEY, _row(failed_payment, FAILED_PAYMENT_FIELDS))
+
+
+def invalidate_transactions():
+    """
+    Drop the cached transactions after rows change in place (e.g. fraud flags),
+    the next read reseeds the buffer from the DB.
+    """
+    key = TRANSACTIONS_KEY
+    try:
+        pipe = get_client().pipeline()
+        pipe.delete(key, _depth_key(key))
+        # Seeds that read the DB before this point see the bump and back off
+        pipe.incr(_generation_key(key))
+        pipe.execute()
+    except redis.RedisError as e:
+        print("⚠️ Could not invalidate recent activity buffer:", str(e))
+
+
+# ------------------ Readers ------------------
+def _depth_key(key):
+    # How many of the newest rows the buffer is known to hold in full
+    return f"{key}:depth"
+
+
+def _generation_key(key):
+    return f"{key}:generation"
+
+
+def _seed(key, rows, depth, generation):
+    """
+    Merge rows read from the DB into the buffer without losing entries pushed
+    concurrently; WATCH retries the merge if a writer gets in first. Skipped if
+    the buffer was invalidated after the rows were read, as they may be stale.
+    """
+    size = settings.RECENT_ACTIVITY_SIZE
+
+    def merge(pipe):
+        if pipe.get(_generation_key(key)) != generation:
+            return
+        merged = {row['id']: _dumps(row) for row in rows}
+        for raw in pipe.lrange(key, 0, -1):
+            merged[json.loads(raw)['id']] = raw
+        newest = sorted(merged.items(), key=lambda item: item[0], reverse=True)[:size]
+        known = int(pipe.get(_depth_key(key)) or 0)
+        pipe.multi()
+        pipe.delete(key)
+        if newest:
+            pipe.rpush(key, *[raw for _, raw in newest])
+        # Pushes only add newer rows at the head, so the depth never shrinks
+        pipe.set(_depth_key(key), max(known, depth))
+
+    get_client().transaction(merge, key, _depth_key(key), _generation_key(key))
+
+
+def _recent(key, model, fields, limit):
+    size = settings.RECENT_ACTIVITY_SIZE
+    limit = max(0, min(limit, size))
+    if limit == 0:
+        return []
+
+    try:
+        pipe = get_client().pipeline(transaction=False)
+        pipe.lrange(key, 0, limit - 1)
+        pipe.get(_depth_key(key))
+        pipe.get(_generation_key(key))
+        cached, depth, generation = pipe.execute()
+        # A short list is still a hit once a seed has shown the table is that small
+        if len(cached) == limit or int(depth or 0) >= limit:
+            return [_loads(raw) for raw in cached]
+    except redis.RedisError as e:
+        print("⚠️ Recent activity buffer unavailable:", str(e))
+        cached = None
+
+    # Cold buffer: read the window from the DB and warm the buffer with it
+    rows = list(model.objects.order_by('-id').values(*fields)[:limit])
+    if cached is not None:
+        try:
+            # Fewer rows than asked for means the buffer now holds the whole table
+            _seed(key, rows, size if len(rows) < limit else limit, generation)
+        except redis.RedisError as e:
+            print("⚠️ Could not seed recent activity buffer:", str(e))
+    return rows
+
+
+def recent_transactions(limit):
+    return _recent(TRANSACTIONS_KEY, Transaction, TRANSACTION_FIELDS, limit)
+
+
+def recent_failed_payments(limit):
+    return _recent(FAILED_PAYMENTS_KEY, FailedPayment, FAILED_PAYMENT_FIELDS, limit)
@@ -0,0 +1,341 @@
+# core/reconciliation.py
+import heapq
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import redis
+import stripe
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models.functions import Collate
+from django.db.transaction import atomic
+
+from .models import Transaction
+from . import outbox, recent_activity
+
+# Reconciles settled Stripe charges against the local Transaction ledger.
+# The window is cut into slices that are paged from Stripe concurrently; each
+# slice is hash-joined against the ledger with one batched lookup per chunk of
+# keys, repaired in bulk and checkpointed so an interrupted run resumes where
+# it stopped. A final sorted merge join finds ledger rows Stripe doesn't know.
+#
+# Rows written before transactions recorded their PaymentIntent have none to
+# join on. Charges missing by key are first matched to those legacy rows on
+# amount and time and linked to them rather than inserted again; while a
+# slice still has legacy rows nothing matched, its missing charges are only
+# reported, as one of those rows may already record them.
+
+LOOKUP_CHUNK = 1000
+CHECKPOINT_TTL = 7 * 24 * 60 * 60
+# Ledger timestamps are insert times and trail the Stripe charge, so rows this
+# close to the window start may belong to the previous window
+ORPHAN_GRACE = timedelta(hours=1)
+# How far a legacy row's insert time may sit from its charge's created time
+LEGACY_MATCH_WINDOW = timedelta(hours=1)
+LEGACY_DESCRIPTION = 'Stripe Checkout Payment'
+COUNT_FIELDS = ('settled', 'missing', 'mismatched', 'backfilled', 'unresolved')
+
+
+class StripeClient:
+    """
+    Thin wrapper over the Stripe list API so tests and dry runs can swap in a
+    stub with the same ``list_charges`` signature.
+    """
+
+    def list_charges(self, created_gte, created_lt, starting_after=None, limit=100):
+        params = {
+            'created': {'gte': created_gte, 'lt': created_lt},
+            'limit': limit,
+        }
+        if starting_after:
+            params['starting_after'] = starting_after
+        page = stripe.Charge.list(api_key=settings.STRIPE_SECRET_KEY, **params)
+        return list(page.data), page.has_more
+
+
+def _settled(charge):
+    # Only charges Stripe has moved into the balance (they carry the id of
+    # their balance transaction) count towards the ledger
+    return (
+        charge.get('paid')
+        and charge.get('status') == 'succeeded'
+        and charge.get('balance_transaction') is not None
+    )
+
+
+def _key(charge):
+    return charge.get('payment_intent') or charge['id']
+
+
+def _created(charge):
+    return datetime.fromtimestamp(charge['created'], tz=dt_timezone.utc)
+
+
+def fetch_slice(client, start, end):
+    """Page through one slice and return its settled charges keyed like the ledger."""
+    settled = {}
+    starting_after = None
+    while True:
+        charges, has_more = client.list_charges(
+            int(start.timestamp()), int(end.timestamp()), starting_after=starting_after
+        )
+        for charge in charges:
+            if _settled(charge):
+                settled[_key(charge)] = charge
+        if not has_more or not charges:
+            return settled
+        starting_after = charges[-1]['id']
+
+
+def _slices(start, end, step):
+    while start < end:
+        yield start, min(start + step, end)
+        start += step
+
+
+# ------------------ Checkpoints ------------------
+class Checkpoint:
+    def __init__(self, start, end):
+        self.client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+        self.key = f"reconcile:{int(start.timestamp())}:{int(end.timestamp())}"
+
+    def done(self):
+        return {
+            int(field): json.loads(value)
+            for field, value in self.client.hgetall(self.key).items()
+        }
+
+    def mark(self, slice_start, summary):
+        pipe = self.client.pipeline()
+        pipe.hset(self.key, int(slice_start.timestamp()), json.dumps(summary))
+        pipe.expire(self.key, CHECKPOINT_TTL)
+        pipe.execute()
+
+    def clear(self):
+        self.client.delete(self.key)
+
+
+# ------------------ Join & repair ------------------
+def _amount(charge):
+    return (Decimal(charge['amount']) / 100).quantize(Decimal('0.01'))
+
+
+def join_slice(remote):
+    """
+    Hash join settled charges with the ledger. Returns (missing, mismatched)
+    where missing are charges with no Transaction and mismatched are
+    (transaction, charge) pairs whose amounts disagree.
+    """
+    keys = list(remote)
+    missing = dict(remote)
+    mismatched = []
+    for i in range(0, len(keys), LOOKUP_CHUNK):
+        local = Transaction.objects.filter(stripe_payment_intent__in=keys[i:i + LOOKUP_CHUNK])
+        for tx in local.only('id', 'amount', 'stripe_payment_intent'):
+            charge = missing.pop(tx.stripe_payment_intent)
+            if tx.amount != _amount(charge):
+                mismatched.append((tx, charge))
+    return list(missing.values()), mismatched
+
+
+def link_legacy(missing, start, end):
+    """
+    Match charges with no Transaction to legacy webhook rows that have no
+    PaymentIntent, on equal amount and insert time close to the charge.
+    Returns (linked, missing, unresolved): (transaction, charge) pairs to
+    link, charges safe to insert, and charges held back because unmatched
+    legacy rows remain in the slice.
+    """
+    if not missing:
+        return [], [], []
+
+    legacy = (
+        Transaction.objects
+        .filter(
+            stripe_payment_intent__isnull=True,
+            transaction_type='credit',
+            description__startswith=LEGACY_DESCRIPTION,
+            timestamp__gte=start - LEGACY_MATCH_WINDOW,
+            timestamp__lt=end + LEGACY_MATCH_WINDOW,
+        )
+        .order_by('timestamp')
+        .only('id', 'amount', 'timestamp', 'stripe_payment_intent')
+    )
+    by_amount = defaultdict(list)
+    for tx in legacy:
+        by_amount[tx.amount].append(tx)
+
+    linked = []
+    unmatched = []
+    for charge in sorted(missing, key=lambda charge: charge['created']):
+        created = _created(charge)
+        candidates = by_amount[_amount(charge)]
+        match = next(
+            (tx for tx in candidates if abs(tx.timestamp - created) <= LEGACY_MATCH_WINDOW),
+            None,
+        )
+        if match is None:
+            unmatched.append(charge)
+        else:
+            candidates.remove(match)
+            linked.append((match, charge))
+
+    leftover = any(
+        start <= tx.timestamp < end
+        for candidates in by_amount.values()
+        for tx in candidates
+    )
+    if leftover:
+        return linked, [], unmatched
+    return linked, unmatched, []
+
+
+def _description(charge):
+    return f"{LEGACY_DESCRIPTION} (reconciled {charge['id']})"
+
+
+def repair(missing, mismatched, linked=()):
+    charges = {_key(charge): charge for charge in missing}
+    created = [
+        Transaction(
+            amount=_amount(charge),
+            transaction_type='credit',
+            description=_description(charge),
+            stripe_payment_intent=key,
+        )
+        for key, charge in charges.items()
+    ]
+    for tx, charge in mismatched:
+        tx.amount = _amount(charge)
+    updated = [tx for tx, _ in mismatched]
+    for tx, charge in linked:
+        tx.stripe_payment_intent = _key(charge)
+    backfilled = [tx for tx, _ in linked]
+
+    with atomic():
+        # The webhook may have recorded some of these since the join; skip those
+        Transaction.objects.bulk_create(created, batch_size=LOOKUP_CHUNK, ignore_conflicts=True)
+        keys = list(charges)
+        created = []
+        for i in range(0, len(keys), LOOKUP_CHUNK):
+            rows = Transaction.objects.filter(stripe_payment_intent__in=keys[i:i + LOOKUP_CHUNK])
+            created += [
+                tx for tx in rows
+                if tx.description == _description(charges[tx.stripe_payment_intent])
+            ]
+        # auto_now_add stamped the insert time; date the rows by their charge so
+        # they fall in the charge's window and not the next night's orphan pass
+        for tx in created:
+            tx.timestamp = _created(charges[tx.stripe_payment_intent])
+        Transaction.objects.bulk_update(created, ['timestamp'], batch_size=LOOKUP_CHUNK)
+        Transaction.objects.bulk_update(updated, ['amount'], batch_size=LOOKUP_CHUNK)
+        Transaction.objects.bulk_update(backfilled, ['stripe_payment_intent'], batch_size=LOOKUP_CHUNK)
+        outbox.bulk_record_transactions(created, 'transaction.created')
+        outbox.bulk_record_transactions(updated, 'transaction.reconciled')
+
+    if created or updated:
+        # New rows are the newest ids and cached rows still carry old amounts
+        recent_activity.invalidate_transactions()
+
+    # Created rows may sit below the sweep's cursor and changed amounts aren't
+    # rescanned at all, so check them directly
+    from .tasks import check_fraud  # tasks imports this module
+    ids = [tx.id for tx in created + updated]
+    for i in range(0, len(ids), LOOKUP_CHUNK):
+        check_fraud.delay(ids[i:i + LOOKUP_CHUNK])
+
+
+def find_orphans(start, end, remote_keys):
+    """
+    Sorted merge join of ledger rows in the window against every settled key
+    Stripe returned; yields Transactions Stripe has no settled charge for.
+    """
+    local = (
+        Transaction.objects
+        .filter(timestamp__gte=start + ORPHAN_GRACE, timestamp__lt=end, stripe_payment_intent__isnull=False)
+        # "C" collation sorts bytewise, matching Python's ordering of the Stripe keys
+        .order_by(Collate('stripe_payment_intent', 'C'))
+        .only('id', 'amount', 'stripe_payment_intent')
+        .iterator(chunk_size=LOOKUP_CHUNK)
+    )
+    remote = iter(remote_keys)
+    current = next(remote, None)
+    for tx in local:
+        while current is not None and current < tx.stripe_payment_intent:
+            current = next(remote, None)
+        if current != tx.stripe_payment_intent:
+            yield tx
+
+
+# ------------------ Entry point ------------------
+def reconcile(start, end, client=None, workers=None, slice_size=None, dry_run=False, resume=True,
+              backfill_only=False, checkpoint=None):
+    """
+    Reconcile settled Stripe charges created in [start, end) with the ledger.
+    Returns a summary dict with counts and ids of rows it could not repair.
+    With backfill_only, legacy rows are linked to their PaymentIntent but
+    nothing is inserted or changed.
+    """
+    client = client or StripeClient()
+    workers = workers or settings.RECONCILE_WORKERS
+    slice_size = slice_size or settings.RECONCILE_SLICE
+    checkpoint = checkpoint or Checkpoint(start, end)
+    done = checkpoint.done() if resume and not dry_run else {}
+
+    summary = dict.fromkeys(COUNT_FIELDS, 0)
+    summary.update(orphans=[], resumed_slices=len(done))
+    for counts in done.values():
+        for field in COUNT_FIELDS:
+            summary[field] += counts.get(field, 0)
+
+    pending = [s for s in _slices(start, end, slice_size) if int(s[0].timestamp()) not in done]
+    remote_keys = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_slice, client, s, e): (s, e) for s, e in pending}
+        # DB work stays on this thread; only the Stripe paging runs in the pool
+        for future in as_completed(futures):
+            slice_start, slice_end = futures[future]
+            remote = future.result()
+            for attempt in range(2):
+                missing, mismatched = join_slice(remote)
+                linked, missing, unresolved = link_legacy(missing, slice_start, slice_end)
+                if backfill_only:
+                    unresolved += missing
+                    missing, mismatched = [], []
+                if dry_run:
+                    break
+                try:
+                    repair(missing, mismatched, linked)
+                    break
+                except IntegrityError:
+                    # A webhook recorded a payment this slice was about to link;
+                    # the repair rolled back, so join again against the new ledger
+                    if attempt:
+                        raise
+                    print("⚠️ Ledger changed during repair, re-joining slice")
+
+            counts = {
+                'settled': len(remote),
+                'missing': len(missing),
+                'mismatched': len(mismatched),
+                'backfilled': len(linked),
+                'unresolved': len(unresolved),
+            }
+            for field, value in counts.items():
+                summary[field] += value
+            remote_keys.append(sorted(remote))
+            if not dry_run:
+                checkpoint.mark(slice_start, counts)
+
+    if done:
+        # Keys from earlier runs weren't kept, so the orphan pass would misreport
+        print("⚠️ Resumed run, skipping orphan check; rerun with resume=False for a full report")
+    else:
+        summary['orphans'] = [tx.id for tx in find_orphans(start, end, heapq.merge(*remote_keys))]
+
+    if not dry_run:
+        checkpoint.clear()
+    return summary
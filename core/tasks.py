@@ -1,22 +1,133 @@
+import redis
 from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from datetime import timedelta
+from django.conf import settings
+from django.db.transaction import atomic
+from django.utils import timezone
 from .models import Transaction
 from .notifications import send_sms_alert
+from . import outbox, recent_activity
+from .reconciliation import reconcile
 
-@shared_task
+# Held for the life of one sweep; expires on its own if a worker dies mid-run
+DETECT_FRAUD_LOCK = 'lock:detect_fraud'
+DETECT_FRAUD_LOCK_TIMEOUT = 10 * 60
+# Highest transaction id a sweep has looked at
+DETECT_FRAUD_LAST_ID = 'detect_fraud:last_id'
+DETECT_FRAUD_CHUNK = 1000
+# Each sweep starts this many ids behind the last one, so rows whose ids
+# committed out of order (long bulk inserts) are still scanned
+DETECT_FRAUD_OVERLAP = 10000
+
+
+@shared_task(ignore_result=True)
+def send_sms(body):
+    send_sms_alert(body)
+
+
+def _is_suspicious(tx):
+    return tx.amount > 1000 or "suspicious" in (tx.description or "").lower()
+
+
+def _flag(tx):
+    tx.is_fraud = True
+    with atomic():
+        tx.save(update_fields=['is_fraud'])
+        outbox.record_transaction(tx, event_type='transaction.flagged_fraud')
+
+    # 🚨 Send SMS alert from the notifications queue
+    msg = (
+        f"🚨 Fraud Alert!\n"
+        f"TX ID: {tx.id}\n"
+        f"Type: {tx.transaction_type}\n"
+        f"Amount: ${tx.amount}\n"
+        f"Description: {tx.description or 'N/A'}"
+    )
+    send_sms.delay(msg)
+
+
+@shared_task(ignore_result=True, soft_time_limit=4 * 60, time_limit=5 * 60)
 def detect_fraud():
-    transactions = Transaction.objects.filter(is_fraud=False)
-
-    for tx in transactions:
-        if tx.amount > 1000 or "suspicious" in tx.description.lower():
-            tx.is_fraud = True
-            tx.save()
-
-            # 🚨 Send SMS alert
-            msg = (
-                f"🚨 Fraud Alert!\n"
-                f"TX ID: {tx.id}\n"
-                f"Amount: ${tx.amount}\n"
-                f"Merchant: {tx.merchant}\n"
-                f"User: {tx.user_id}"
-            )
-            send_sms_alert(msg)
+    client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    lock = client.lock(DETECT_FRAUD_LOCK, timeout=DETECT_FRAUD_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        print("⏭️ detect_fraud already running, skipping this sweep")
+        return
+
+    try:
+        _detect_fraud(client)
+    except SoftTimeLimitExceeded:
+        # Rows flagged so far are saved; the next scheduled sweep picks up the rest
+        print("⏱️ detect_fraud hit its time limit, stopping early")
+    finally:
+        lock.release()
+
+
+def _detect_fraud(client):
+    last_id = int(client.get(DETECT_FRAUD_LAST_ID) or 0)
+    transactions = (
+        Transaction.objects
+        .filter(id__gt=max(0, last_id - DETECT_FRAUD_OVERLAP), is_fraud=False)
+        .order_by('id')
+        .iterator(chunk_size=DETECT_FRAUD_CHUNK)
+    )
+    scanned = 0
+    flagged = False
+
+    try:
+        for tx in transactions:
+            if _is_suspicious(tx):
+                _flag(tx)
+                flagged = True
+
+            # Never move back: the overlap rescans rows below the saved id
+            last_id = max(last_id, tx.id)
+            scanned += 1
+            if scanned % DETECT_FRAUD_CHUNK == 0:
+                client.set(DETECT_FRAUD_LAST_ID, last_id)
+    finally:
+        # Saved even when the time limit cuts the sweep short
+        client.set(DETECT_FRAUD_LAST_ID, last_id)
+        if flagged:
+            # Cached rows still carry the old is_fraud value
+            recent_activity.invalidate_transactions()
+
+
+@shared_task(ignore_result=True, soft_time_limit=60, time_limit=90)
+def check_fraud(ids):
+    """Check specific rows now, e.g. ones written or changed behind the sweep's cursor."""
+    flagged = False
+    for tx in Transaction.objects.filter(id__in=ids, is_fraud=False):
+        if _is_suspicious(tx):
+            _flag(tx)
+            flagged = True
+    if flagged:
+        recent_activity.invalidate_transactions()
+
+
+@shared_task(ignore_result=True, soft_time_limit=50, time_limit=60)
+def relay_outbox():
+    try:
+        published = outbox.relay(max_batches=settings.OUTBOX_RELAY_MAX_BATCHES)
+    except SoftTimeLimitExceeded:
+        # Batches sent so far are deleted; the next run carries on from there
+        print("⏱️ relay_outbox hit its time limit, stopping early")
+        return
+    if published:
+        print(f"📤 Relayed {published} outbox events")
+
+
+@shared_task(ignore_result=True, soft_time_limit=55 * 60, time_limit=60 * 60)
+def report_reconcile_stripe(days=1):
+    # Whole UTC days ending at today's midnight, so reruns hit the same checkpoint
+    end = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    summary = reconcile(end - timedelta(days=days), end)
+    print(f"🧾 Stripe reconciliation: {summary}")
+    if summary['missing'] or summary['mismatched'] or summary['unresolved'] or summary['orphans']:
+        send_sms.delay(
+            f"🧾 Reconciliation repaired {summary['missing']} missing and "
+            f"{summary['mismatched']} mismatched payments, "
+            f"{summary['unresolved']} missing need review, "
+            f"{len(summary['orphans'])} unmatched in the ledger"
+        )
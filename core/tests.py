@@ -1,3 +1,477 @@
-from django.test import TestCase
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import outbox, recent_activity
+from .models import OutboxEvent, Transaction
+from .reconciliation import ORPHAN_GRACE, fetch_slice, find_orphans, reconcile
+
+START = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+END = START + timedelta(days=1)
+SLICE = timedelta(hours=6)
+
+
+class FakeRedis:
+    """In-memory stand-in for the few Redis commands the app uses."""
+
+    def __init__(self):
+        self.data = {}
+
+    def _encode(self, value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = self._encode(value)
+
+    def incr(self, key):
+        value = int(self.data.get(key, b'0')) + 1
+        self.data[key] = self._encode(value)
+        return value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def lpush(self, key, *values):
+        items = self.data.setdefault(key, [])
+        for value in values:
+            items.insert(0, self._encode(value))
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(self._encode(value) for value in values)
+
+    def lrange(self, key, start, end):
+        items = self.data.get(key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.lrange(key, start, end)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def lock(self, name, timeout=None):
+        return FakeLock(self, name)
+
+    def transaction(self, func, *watches):
+        pipe = FakePipeline(self, immediate=True)
+        func(pipe)
+        return pipe.execute()
+
+
+class FakePipeline:
+    def __init__(self, client, immediate=False):
+        self.client = client
+        self.immediate = immediate
+        self.commands = []
+
+    def multi(self):
+        self.immediate = False
+
+    def execute(self):
+        results = [getattr(self.client, name)(*args) for name, args in self.commands]
+        self.commands = []
+        return results
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def call(*args):
+            if self.immediate:
+                return method(*args)
+            self.commands.append((name, args))
+            return self
+
+        return call
+
+
+class FakeLock:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def acquire(self, blocking=True):
+        if self.name in self.client.data:
+            return False
+        self.client.data[self.name] = b'1'
+        return True
+
+    def extend(self, additional_time, replace_ttl=False):
+        pass
+
+    def release(self):
+        self.client.delete(self.name)
+
+
+@override_settings(RECENT_ACTIVITY_SIZE=5)
+class RecentActivityTests(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('core.recent_activity.get_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create(self, amount='12.50'):
+        return Transaction.objects.create(amount=Decimal(amount), transaction_type='credit', description='Test')
+
+    def add(self, amount='12.50'):
+        tx = self.create(amount)
+        recent_activity.record_transaction(tx)
+        return tx
+
+    def test_pushes_newest_first_and_caps_at_size(self):
+        added = [self.add() for _ in range(7)]
+
+        self.assertEqual(len(self.redis.lrange(recent_activity.TRANSACTIONS_KEY, 0, -1)), 5)
+        with self.assertNumQueries(0):
+            recent = recent_activity.recent_transactions(3)
+        self.assertEqual([row['id'] for row in recent], [tx.id for tx in reversed(added[-3:])])
+
+    def test_cached_rows_serialize_like_db_rows(self):
+        self.add('50.00')
+
+        cached = recent_activity.recent_transactions(1)
+        db = list(Transaction.objects.order_by('-id').values(*recent_activity.TRANSACTION_FIELDS)[:1])
+
+        self.assertEqual(json.dumps(cached, cls=DjangoJSONEncoder), json.dumps(db, cls=DjangoJSONEncoder))
+
+    def test_cold_read_seeds_buffer(self):
+        created = [self.create() for _ in range(3)]
+
+        with self.assertNumQueries(1):
+            first = recent_activity.recent_transactions(2)
+        with self.assertNumQueries(0):
+            second = recent_activity.recent_transactions(2)
+        self.assertEqual([row['id'] for row in second], [row['id'] for row in first])
+        self.assertEqual([row['id'] for row in second], [created[2].id, created[1].id])
+
+    def test_short_table_is_a_hit_once_seeded(self):
+        self.create()
+        self.create()
+
+        with self.assertNumQueries(1):
+            recent_activity.recent_transactions(4)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(recent_activity.recent_transactions(4)), 2)
+
+    def test_invalidate_clears_buffer_and_stale_seed_backs_off(self):
+        self.add()
+        self.add()
+        key = recent_activity.TRANSACTIONS_KEY
+        rows = list(Transaction.objects.order_by('-id').values(*recent_activity.TRANSACTION_FIELDS))
+        generation = self.redis.get(recent_activity._generation_key(key))
+
+        recent_activity.invalidate_transactions()
+        # A seed that read the DB before the invalidation must not write back
+        recent_activity._seed(key, rows, 2, generation)
+
+        self.assertEqual(self.redis.lrange(key, 0, -1), [])
+        with self.assertNumQueries(1):
+            recent_activity.recent_transactions(2)
+
+
+class RecordingPublisher:
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def publish(self, events):
+        if self.error:
+            raise self.error
+        self.batches.append(events)
+
+
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.publisher = RecordingPublisher()
+        for target, value in (
+            ('core.outbox.redis.Redis.from_url', self.redis),
+            ('core.outbox.get_publisher', self.publisher),
+        ):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def record(self, count):
+        events = []
+        for _ in range(count):
+            tx = Transaction.objects.create(amount=Decimal('12.50'), transaction_type='credit', description='Test')
+            events.append(outbox.record_transaction(tx))
+        return events
+
+    def test_publishes_in_id_order_and_deletes_each_batch(self):
+        events = self.record(5)
+
+        self.assertEqual(outbox.relay(batch_size=2), 5)
+
+        self.assertEqual([len(batch) for batch in self.publisher.batches], [2, 2, 1])
+        published = [event for batch in self.publisher.batches for event in batch]
+        self.assertEqual([event['id'] for event in published], [event.id for event in events])
+        self.assertEqual(published[0]['key'], f"transaction:{events[0].aggregate_id}")
+        self.assertEqual(published[0]['payload']['amount'], '12.50')
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_max_batches_bounds_a_run(self):
+        events = self.record(5)
+
+        self.assertEqual(outbox.relay(batch_size=2, max_batches=1), 2)
+
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list('id', flat=True)),
+            [event.id for event in events[2:]],
+        )
+
+    def test_failed_publish_keeps_events_and_releases_lock(self):
+        self.record(3)
+        self.publisher.error = RuntimeError("broker down")
+
+        with self.assertRaises(RuntimeError):
+            outbox.relay(batch_size=2)
+
+        self.assertEqual(OutboxEvent.objects.count(), 3)
+        self.assertIsNone(self.redis.get(outbox.RELAY_LOCK))
+
+    def test_skips_while_another_relay_holds_the_lock(self):
+        self.record(2)
+        self.redis.lock(outbox.RELAY_LOCK).acquire(blocking=False)
+
+        self.assertEqual(outbox.relay(), 0)
+
+        self.assertEqual(self.publisher.batches, [])
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+
+
+class StubStripeClient:
+    """Serves charges newest first in pages, the way Stripe's list API does."""
+
+    def __init__(self, charges, page_size=2):
+        self.charges = sorted(charges, key=lambda charge: charge['created'], reverse=True)
+        self.page_size = page_size
+        self.calls = []
+
+    def list_charges(self, created_gte, created_lt, starting_after=None, limit=100):
+        self.calls.append((created_gte, created_lt, starting_after))
+        window = [c for c in self.charges if created_gte <= c['created'] < created_lt]
+        if starting_after:
+            ids = [c['id'] for c in window]
+            window = window[ids.index(starting_after) + 1:]
+        return window[:self.page_size], len(window) > self.page_size
+
+
+class StubCheckpoint:
+    def __init__(self, done=None):
+        self.slices = dict(done or {})
+        self.cleared = False
+
+    def done(self):
+        return dict(self.slices)
+
+    def mark(self, slice_start, summary):
+        self.slices[int(slice_start.timestamp())] = summary
+
+    def clear(self):
+        self.cleared = True
+
+
+def charge(n, amount, created, settled=True):
+    return {
+        'id': f'ch_{n}',
+        'payment_intent': f'pi_{n}',
+        'amount': amount,
+        'created': int(created.timestamp()),
+        'paid': True,
+        'status': 'succeeded',
+        'balance_transaction': f'txn_{n}' if settled else None,
+    }
+
+
+def ledger(amount, at, payment_intent=None):
+    tx = Transaction.objects.create(
+        amount=amount,
+        transaction_type='credit',
+        description='Stripe Checkout Payment (Customer: jo@example.com)',
+        stripe_payment_intent=payment_intent,
+    )
+    # timestamp is auto_now_add, so place the row in time afterwards
+    Transaction.objects.filter(id=tx.id).update(timestamp=at)
+    tx.refresh_from_db()
+    return tx
+
+
+class FetchSliceTests(SimpleTestCase):
+    def test_pages_through_slice_and_keeps_settled_charges(self):
+        charges = [charge(n, 1000, START + timedelta(minutes=n)) for n in range(5)]
+        charges.append(charge(5, 1000, START + timedelta(minutes=5), settled=False))
+        client = StubStripeClient(charges, page_size=2)
+
+        settled = fetch_slice(client, START, START + SLICE)
+
+        self.assertEqual(sorted(settled), [f'pi_{n}' for n in range(5)])
+        self.assertEqual(len(client.calls), 3)
+        self.assertEqual([call[2] for call in client.calls], [None, 'ch_4', 'ch_2'])
+
+    def test_ignores_charges_outside_slice(self):
+        client = StubStripeClient([
+            charge(1, 1000, START + timedelta(hours=1)),
+            charge(2, 1000, START + SLICE),
+        ])
+
+        self.assertEqual(list(fetch_slice(client, START, START + SLICE)), ['pi_1'])
+
+
+@mock.patch('core.tasks.check_fraud')
+@mock.patch('core.reconciliation.recent_activity')
+class ReconcileTests(TestCase):
+    def run_reconcile(self, charges, **kwargs):
+        kwargs.setdefault('checkpoint', StubCheckpoint())
+        return reconcile(START, END, client=StubStripeClient(charges), workers=2, slice_size=SLICE, **kwargs)
+
+    def test_repairs_missing_and_mismatched_rows(self, recent_activity, check_fraud):
+        at = START + timedelta(hours=3)
+        ledger(Decimal('10.00'), at + timedelta(minutes=1), 'pi_1')
+        mismatched = ledger(Decimal('5.00'), at + timedelta(minutes=1), 'pi_2')
+
+        summary = self.run_reconcile([
+            charge(1, 1000, at),
+            charge(2, 700, at),
+            charge(3, 1200, at),
+        ])
+
+        self.assertEqual(summary['settled'], 3)
+        self.assertEqual(summary['missing'], 1)
+        self.assertEqual(summary['mismatched'], 1)
+        self.assertEqual(summary['orphans'], [])
+        mismatched.refresh_from_db()
+        self.assertEqual(mismatched.amount, Decimal('7.00'))
+        created = Transaction.objects.get(stripe_payment_intent='pi_3')
+        self.assertEqual(created.amount, Decimal('12.00'))
+        self.assertEqual(created.timestamp, at)
+        self.assertEqual(
+            sorted(OutboxEvent.objects.values_list('event_type', flat=True)),
+            ['transaction.created', 'transaction.reconciled'],
+        )
+        recent_activity.invalidate_transactions.assert_called()
+        check_fraud.delay.assert_called_once_with([created.id, mismatched.id])
+
+    def test_dry_run_changes_nothing(self, recent_activity, check_fraud):
+        at = START + timedelta(hours=3)
+        ledger(Decimal('5.00'), at, 'pi_2')
+        checkpoint = StubCheckpoint()
+
+        summary = self.run_reconcile([charge(2, 700, at), charge(3, 1200, at)], dry_run=True, checkpoint=checkpoint)
+
+        self.assertEqual((summary['missing'], summary['mismatched']), (1, 1))
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(Transaction.objects.get().amount, Decimal('5.00'))
+        self.assertEqual(checkpoint.slices, {})
+
+    def test_checkpoints_every_slice_then_clears(self, recent_activity, check_fraud):
+        checkpoint = StubCheckpoint()
+
+        self.run_reconcile([charge(1, 1000, START + timedelta(hours=7))], checkpoint=checkpoint)
+
+        self.assertEqual(len(checkpoint.slices), 4)
+        self.assertEqual(checkpoint.slices[int((START + SLICE).timestamp())]['missing'], 1)
+        self.assertTrue(checkpoint.cleared)
+
+    def test_resume_skips_checkpointed_slices(self, recent_activity, check_fraud):
+        done = {int(START.timestamp()): {'settled': 2, 'missing': 1, 'mismatched': 0}}
+        client = StubStripeClient([
+            charge(1, 1000, START + timedelta(hours=1)),
+            charge(2, 1000, START + timedelta(hours=7)),
+        ])
+
+        summary = reconcile(
+            START, END, client=client, workers=2, slice_size=SLICE, checkpoint=StubCheckpoint(done)
+        )
+
+        self.assertNotIn(int(START.timestamp()), [call[0] for call in client.calls])
+        self.assertEqual(summary['resumed_slices'], 1)
+        self.assertEqual(summary['settled'], 3)
+        self.assertEqual(summary['missing'], 2)
+        self.assertFalse(Transaction.objects.filter(stripe_payment_intent='pi_1').exists())
+        self.assertTrue(Transaction.objects.filter(stripe_payment_intent='pi_2').exists())
+
+    def test_links_legacy_row_instead_of_inserting(self, recent_activity, check_fraud):
+        at = START + timedelta(hours=3)
+        legacy = ledger(Decimal('12.00'), at + timedelta(minutes=2))
+
+        summary = self.run_reconcile([charge(9, 1200, at)])
+
+        self.assertEqual((summary['backfilled'], summary['missing']), (1, 0))
+        self.assertEqual(Transaction.objects.count(), 1)
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.stripe_payment_intent, 'pi_9')
+
+    def test_holds_back_missing_while_legacy_rows_unmatched(self, recent_activity, check_fraud):
+        at = START + timedelta(hours=3)
+        ledger(Decimal('99.00'), at + timedelta(minutes=2))
+
+        summary = self.run_reconcile([charge(9, 1200, at)])
+
+        self.assertEqual((summary['missing'], summary['unresolved']), (0, 1))
+        self.assertFalse(Transaction.objects.filter(stripe_payment_intent='pi_9').exists())
+
+
+class FindOrphansTests(TestCase):
+    def test_merge_join_yields_rows_without_settled_charge(self):
+        at = START + ORPHAN_GRACE + timedelta(hours=1)
+        ledger(Decimal('1.00'), at, 'pi_B')
+        orphan = ledger(Decimal('1.00'), at, 'pi_a')
+        ledger(Decimal('1.00'), at, 'pi_c')
+        ledger(Decimal('1.00'), at)
+        # Too close to the window start to be sure it belongs to this window
+        ledger(Decimal('1.00'), START + timedelta(minutes=5), 'pi_early')
+
+        orphans = find_orphans(START, END, iter(['pi_B', 'pi_c', 'pi_z']))
+
+        self.assertEqual([tx.id for tx in orphans], [orphan.id])
+
+
+@skipUnless(connection.vendor == 'postgresql', "set_transactions_fraud is PostgreSQL SQL")
+class SetTransactionsFraudTests(TestCase):
+    def create(self, timestamp, is_fraud=False):
+        tx = Transaction.objects.create(
+            amount=Decimal('12.50'), transaction_type='debit', description='Test', is_fraud=is_fraud
+        )
+        Transaction.objects.filter(id=tx.id).update(timestamp=timestamp)
+        tx.refresh_from_db()
+        return tx
+
+    def test_flags_changed_rows_and_writes_their_events(self):
+        with_micros = self.create(START + timedelta(seconds=1, microseconds=123456))
+        whole_second = self.create(START + timedelta(seconds=2))
+        self.create(START, is_fraud=True)
+
+        changed = outbox.set_transactions_fraud(Transaction.objects.all(), True, 'transaction.flagged_fraud')
+
+        self.assertEqual(changed, 2)
+        self.assertFalse(Transaction.objects.filter(is_fraud=False).exists())
+        events = {event.aggregate_id: event for event in OutboxEvent.objects.all()}
+        self.assertEqual(set(events), {with_micros.id, whole_second.id})
+        for tx in (with_micros, whole_second):
+            tx.is_fraud = True
+            event = events[tx.id]
+            self.assertEqual(event.event_type, 'transaction.flagged_fraud')
+            # Same payload record_transaction would have written, once encoded
+            expected = {field: getattr(tx, field) for field in outbox.TRANSACTION_FIELDS}
+            self.assertEqual(event.payload, json.loads(json.dumps(expected, cls=DjangoJSONEncoder)))
+        self.assertEqual(events[with_micros.id].payload['timestamp'], '2026-01-01T00:00:01.123Z')
+        self.assertEqual(events[whole_second.id].payload['amount'], '12.50')
+
+    def test_skips_rows_already_in_that_state(self):
+        self.create(START, is_fraud=True)
+
+        changed = outbox.set_transactions_fraud(Transaction.objects.all(), True, 'transaction.flagged_fraud')
+
+        self.assertEqual(changed, 0)
+        self.assertFalse(OutboxEvent.objects.exists())
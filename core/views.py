@@ -1,12 +1,15 @@
 from django.shortcuts import render, redirect
 from django.db.models import Sum
 from django.conf import settings
+from django.db.transaction import atomic
 from .models import Transaction, FailedPayment
+from . import outbox, recent_activity
 from twilio.rest import Client
 import stripe
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse, HttpResponse
 from datetime import datetime
+from decimal import Decimal
 
 # ------------------ Stripe Setup ------------------
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -73,7 +76,11 @@ def stripe_webhook(request):
         session = event['data']['object']
         print("🎯 Checkout Session ID:", session.get('id'))
 
-        if session.get('payment_status') == 'paid':
+        payment_intent = session.get('payment_intent')
+        if payment_intent and Transaction.objects.filter(stripe_payment_intent=payment_intent).exists():
+            # Redelivered event, or reconciliation already backfilled this payment
+            print("↩️ Payment already recorded:", payment_intent)
+        elif session.get('payment_status') == 'paid':
             customer_id = session.get('customer')
             amount_total = session.get('amount_total') or 0
             description = 'Stripe Checkout Payment'
@@ -84,12 +91,17 @@ def stripe_webhook(request):
                 email = customer.get('email', '')
                 name = customer.get('name', '')
 
-                transaction = Transaction.objects.create(
-                    amount=amount_total / 100,
-                    transaction_type='credit',
-                    description=f"{description} (Customer: {name or email})",
-                    timestamp=timestamp
-                )
+                with atomic():
+                    transaction = Transaction.objects.create(
+                        # Decimal like the column, so cached rows and events match a DB read
+                        amount=(Decimal(amount_total) / 100).quantize(Decimal('0.01')),
+                        transaction_type='credit',
+                        description=f"{description} (Customer: {name or email})",
+                        timestamp=timestamp,
+                        stripe_payment_intent=payment_intent
+                    )
+                    outbox.record_transaction(transaction)
+                recent_activity.record_transaction(transaction)
 
                 # Send SMS notification on successful payment
                 send_success_sms(name or email, amount_total / 100)
@@ -116,12 +128,15 @@ def stripe_webhook(request):
                 print("⚠️ Could not retrieve customer:", str(e))
 
         # Save to DB
-        FailedPayment.objects.create(
-            amount=amount / 100,
-            error_message=error_message,
-            customer_id=customer_id,
-            email=email
-        )
+        with atomic():
+            failed_payment = FailedPayment.objects.create(
+                amount=amount / 100,
+                error_message=error_message,
+                customer_id=customer_id,
+                email=email
+            )
+            outbox.record_failed_payment(failed_payment)
+        recent_activity.record_failed_payment(failed_payment)
 
         # Send SMS Alert for failed payment
         send_failed_payment_sms(amount, error_message, email)
@@ -138,7 +153,9 @@ def dashboard(request):
     fraud_count = transactions.filter(is_fraud=True).count()
 
     context = {
-        'transactions': transactions,
+        # Newest rows come from the recent-activity buffer, not a full table scan
+        'transactions': recent_activity.recent_transactions(settings.DASHBOARD_RECENT_LIMIT),
+        'recent_limit': settings.DASHBOARD_RECENT_LIMIT,
         'total_transactions': total_transactions,
         'total_revenue': total_revenue,
         'fraud_count': fraud_count,
@@ -147,6 +164,13 @@ def dashboard(request):
 
 # ------------------ Transaction API ------------------
 def transaction_api(request):
+    # ?limit=N serves the newest N rows, from the recent-activity buffer when warm
+    limit = request.GET.get('limit')
+    if limit and limit.isdigit() and int(limit) <= settings.RECENT_ACTIVITY_SIZE:
+        recent = recent_activity.recent_transactions(int(limit))
+        # The buffer is newest-first; the chart plots oldest to newest like the full list
+        return JsonResponse(recent[::-1], safe=False)
+
     transactions = Transaction.objects.all().values(
         'id', 'amount', 'description', 'timestamp', 'transaction_type', 'is_fraud'
     )